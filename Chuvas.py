@@ -1,10 +1,12 @@
 import streamlit as st
 import pandas as pd
-from unidecode import unidecode
 import io
-import plotly.express as px
 from datetime import datetime
+from typing import Optional
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from msal import ConfidentialClientApplication
 
 # Configuração da página
@@ -71,15 +73,13 @@ except KeyError as e:
     st.stop()
 
 
-@st.cache_data(ttl=300)  # Cache por 5 minutos
-def get_color_palette():
-    """Paleta de cores moderna"""
-    return {
-        'supervisor': ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD', '#98D8CA'],
-        'encarregado': '#FFE66D',
-        'funcionario': '#A8E6CF',
-        'background': '#F8F9FA'
-    }
+# Paleta de cores moderna (constante: dispensa o cache do Streamlit)
+PALETA_CORES = {
+    'supervisor': ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD', '#98D8CA'],
+    'encarregado': '#FFE66D',
+    'funcionario': '#A8E6CF',
+    'background': '#F8F9FA'
+}
 
 
 # Mapeamento flexível de colunas (melhorado)
@@ -91,18 +91,37 @@ COLUNAS_ESPERADAS = {
     "supervisor": ["supervisor", "gestor", "coordenador", "manager", "chefe"]
 }
 
+# Índice invertido sinônimo -> chave; sinônimos mais longos primeiro (o mais específico vence)
+SINONIMO_PARA_CHAVE = {s: chave for chave, sinonimos in COLUNAS_ESPERADAS.items() for s in sinonimos}
+SINONIMOS_POR_TAMANHO = sorted(SINONIMO_PARA_CHAVE, key=len, reverse=True)
+
+# Acentos do português -> ASCII (str.translate em C; unidecode fica como fallback)
+TABELA_ACENTOS = str.maketrans(
+    "áàâãäéèêíïóôõöúüçÁÀÂÃÄÉÈÊÍÏÓÔÕÖÚÜÇ",
+    "aaaaaeeeiioooouucAAAAAEEEIIOOOOUUC"
+)
+
+
+def normalizar_coluna(coluna: str) -> str:
+    """Nome de coluna em minúsculas, sem espaços nas pontas e sem acentos"""
+    normalizada = coluna.translate(TABELA_ACENTOS).lower().strip()
+    if not normalizada.isascii():
+        from unidecode import unidecode  # import tardio: só para caracteres fora da tabela
+        normalizada = unidecode(normalizada)
+    return normalizada
+
 
-@st.cache_data
 def mapear_colunas(colunas_df: list) -> dict:
-    """Mapeamento inteligente de colunas com cache"""
+    """Mapeamento inteligente de colunas (primeira coluna encontrada para cada chave)"""
     mapeamento = {}
-    atuais = [unidecode(c.lower().strip()) for c in colunas_df]
-
-    for chave, sinonimos in COLUNAS_ESPERADAS.items():
-        for i, col_norm in enumerate(atuais):
-            if any(col_norm.startswith(s) for s in sinonimos):
-                mapeamento[chave] = colunas_df[i]
+    for col in colunas_df:
+        col_norm = normalizar_coluna(col)
+        for sinonimo in SINONIMOS_POR_TAMANHO:
+            if col_norm.startswith(sinonimo):
+                mapeamento.setdefault(SINONIMO_PARA_CHAVE[sinonimo], col)
                 break
+        if len(mapeamento) == len(COLUNAS_ESPERADAS):
+            break
     return mapeamento
 
 
@@ -114,120 +133,182 @@ def validar_dados(df: pd.DataFrame) -> tuple[bool, list]:
         erros.append("❌ Planilha está vazia")
         return False, erros
 
-    # Verificar valores nulos em colunas críticas
-    colunas_criticas = ["nome", "funcao", "encarregado", "supervisor"]
-    for col in colunas_criticas:
-        if col in df.columns:
-            nulos = df[col].isnull().sum()
-            if nulos > 0:
-                erros.append(f"⚠️ {nulos} valores vazios na coluna '{col}'")
+    # Verificar valores nulos em colunas críticas (contagem de todas em uma única passada)
+    colunas_criticas = [c for c in ["nome", "funcao", "encarregado", "supervisor"] if c in df.columns]
+    for col, nulos in df[colunas_criticas].isnull().sum().items():
+        if nulos > 0:
+            erros.append(f"⚠️ {nulos} valores vazios na coluna '{col}'")
 
-    # Verificar duplicatas
-    if df.duplicated().sum() > 0:
-        erros.append(f"⚠️ {df.duplicated().sum()} linhas duplicadas encontradas")
+    # Verificar duplicatas pela chave natural (mesma pessoa na mesma data) quando disponível
+    chave = [c for c in ["data", "nome"] if c in df.columns]
+    duplicadas = df.duplicated(subset=chave).sum() if len(chave) == 2 else df.duplicated().sum()
+    if duplicadas > 0:
+        erros.append(f"⚠️ {duplicadas} linhas duplicadas encontradas")
 
     return len(erros) == 0, erros
 
 
 def limpar_dados(df: pd.DataFrame) -> pd.DataFrame:
-    """Limpeza e padronização dos dados"""
-    df_clean = df.copy()
+    """Limpeza e padronização dos dados (sem cópia: sobrescreve texto e data no df recebido e retorna outro DataFrame)"""
+    df_clean = df
 
-    # Remover espaços extras
-    for col in df_clean.select_dtypes(include=['object']).columns:
-        df_clean[col] = df_clean[col].astype(str).str.strip()
+    # Texto já chega como string Arrow da leitura; só colunas object avulsas precisam de conversão
+    # (a data fica de fora: células de data do Excel virariam texto "aaaa-mm-dd" lido com dayfirst)
+    colunas_objeto = df_clean.select_dtypes(include=['object']).columns.drop("data", errors="ignore")
+    if len(colunas_objeto):
+        df_clean[colunas_objeto] = df_clean[colunas_objeto].astype("string[pyarrow]")
 
-    # Padronizar data
+    # Remover espaços extras (strip vetorizado do Arrow em todas as colunas de texto)
+    colunas_texto = df_clean.select_dtypes(include=['string']).columns
+    df_clean[colunas_texto] = df_clean[colunas_texto].apply(lambda s: s.str.strip())
+
+    # Padronizar data (mantida como datetime64; formatação só na exibição)
+    # format="mixed": células de data e texto dd/mm/aaaa na mesma coluna, cada valor interpretado isoladamente
     if 'data' in df_clean.columns:
-        df_clean["data"] = pd.to_datetime(df_clean["data"], errors="coerce").dt.strftime("%d/%m/%Y")
+        df_clean["data"] = pd.to_datetime(df_clean["data"], errors="coerce", dayfirst=True, format="mixed").dt.normalize()
 
     # Remover duplicatas
     df_clean = df_clean.drop_duplicates()
 
+    # Colunas de baixa cardinalidade como categoria (comparações e agrupamentos por código inteiro)
+    for col in ("supervisor", "encarregado", "funcao", "nome"):
+        if col in df_clean.columns:
+            df_clean[col] = df_clean[col].astype("category")
+
     return df_clean
 
 
+@st.cache_data(show_spinner=False, max_entries=4)  # Poucas versões da planilha em memória
+def processar_planilha(conteudo: bytes) -> tuple[pd.DataFrame, bool, list]:
+    """Lê, renomeia, limpa e valida a planilha em um único passo (cache pelos bytes do arquivo)"""
+    df_raw = ler_planilha_excel(conteudo)
+    mapeamento = mapear_colunas(df_raw.columns.tolist())
+    df = limpar_dados(df_raw.rename(columns={v: k for k, v in mapeamento.items()}))
+    valido, erros = validar_dados(df)
+    return df, valido, erros
+
+
+def formatar_data(data: pd.Timestamp) -> str:
+    """Formata a data para exibição (dd/mm/aaaa)"""
+    return data.strftime("%d/%m/%Y")
+
+
 # ———————————————————————————
 # 2. Funções SharePoint - Método que funcionou
 
+@st.cache_resource
+def obter_sessao_http() -> requests.Session:
+    """Sessão HTTP compartilhada entre reruns (reaproveita conexões TLS com o Graph)"""
+    sessao = requests.Session()
+    retentativas = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    sessao.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retentativas))
+    return sessao
+
+
+@st.cache_data(show_spinner=False, max_entries=4)  # Poucas versões da planilha em memória
+def ler_planilha_excel(conteudo: bytes) -> pd.DataFrame:
+    """Converte os bytes do .xlsx em DataFrame (cache pelo conteúdo do arquivo)"""
+    buffer = io.BytesIO(conteudo)
+
+    # Ler só o cabeçalho para localizar a coluna de data antes da leitura completa
+    colunas = pd.read_excel(buffer, engine="calamine", sheet_name=0, nrows=0).columns.tolist()
+    coluna_data = mapear_colunas(colunas).get("data")
+    buffer.seek(0)
+
+    # Texto direto como string Arrow; a coluna de data fica de fora do dtype para que células de data
+    # do Excel cheguem como datetime (texto dd/mm/aaaa é convertido em limpar_dados, com dayfirst)
+    return pd.read_excel(
+        buffer,
+        engine="calamine",
+        sheet_name=0,
+        dtype={c: "string[pyarrow]" for c in colunas if c != coluna_data},
+    )
+
+
+@st.cache_resource
+def obter_app_msal() -> ConfidentialClientApplication:
+    """Aplicação MSAL compartilhada (o cache interno de tokens evita novo login a cada download)"""
+    return ConfidentialClientApplication(
+        SHAREPOINT_CONFIG["client_id"],
+        authority=f"https://login.microsoftonline.com/{SHAREPOINT_CONFIG['tenant_id']}",
+        client_credential=SHAREPOINT_CONFIG["client_secret"],
+    )
+
+
+@st.cache_data(ttl=86400, show_spinner=False)  # Cache por 24 horas
+def obter_site_id(_headers: dict) -> str:
+    """ID do site da Intranet no Graph (token fora da chave do cache)"""
+    site_url = f"https://graph.microsoft.com/v1.0/sites/{SHAREPOINT_CONFIG['site_name']}:{SHAREPOINT_CONFIG['site_path']}"
+    site_response = obter_sessao_http().get(site_url, headers=_headers, timeout=(5, 30))
+
+    if site_response.status_code != 200:
+        raise RuntimeError(f"Erro ao obter site: {site_response.status_code} - {site_response.text}")
+    return site_response.json()['id']
+
+
+def obter_item(headers: dict, site_id: str) -> dict:
+    """ID e eTag da planilha, acessada direto pelo caminho no drive (sem busca; consulta leve, sem cache)"""
+    # file_path inclui a biblioteca padrão do site, que é a raiz do drive no Graph
+    biblioteca = f"{SHAREPOINT_CONFIG['site_path']}/Documentos Compartilhados"
+    pasta = SHAREPOINT_CONFIG["file_path"].removeprefix(biblioteca).strip("/")
+    caminho = quote(f"{pasta}/{SHAREPOINT_CONFIG['arquivo_nome']}")
+
+    item_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{caminho}?$select=id,eTag"
+    item_response = obter_sessao_http().get(item_url, headers=headers, timeout=(5, 30))
+
+    if item_response.status_code == 404:
+        raise FileNotFoundError(f"Arquivo '{SHAREPOINT_CONFIG['arquivo_nome']}' não encontrado em '{pasta}'")
+    item_response.raise_for_status()
+    return item_response.json()
+
+
+@st.cache_data(ttl=3600, show_spinner=False)  # Cache por 1 hora (versão garantida pelo eTag)
+def baixar_item_bytes(_headers: dict, site_id: str, item_id: str, etag: str) -> bytes:
+    """Conteúdo bruto do arquivo no drive do site; o eTag na chave invalida o cache quando o arquivo muda"""
+    download_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}/content"
+
+    # Download em blocos unidos uma única vez (sem BytesIO intermediário e cópia extra)
+    with obter_sessao_http().get(download_url, headers=_headers, stream=True, timeout=(5, 60)) as download_response:
+        download_response.raise_for_status()
+        return b"".join(download_response.iter_content(chunk_size=65536))
+
+
 @st.cache_data(ttl=300)  # Cache por 5 minutos
-def baixar_planilha_sharepoint_direto():
-    """Baixa a planilha do SharePoint usando o método que funcionou"""
+def baixar_planilha_sharepoint_direto(debug: bool = False):
+    """Baixa a planilha do SharePoint usando o método que funcionou (mensagens de etapa só com debug)"""
     try:
-        # Configurar autenticação
-        app = ConfidentialClientApplication(
-            SHAREPOINT_CONFIG["client_id"],
-            authority=f"https://login.microsoftonline.com/{SHAREPOINT_CONFIG['tenant_id']}",
-            client_credential=SHAREPOINT_CONFIG["client_secret"],
-        )
-
-        # Obter token
-        st.write("🔐 Obtendo token de acesso...")
-        result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+        # Obter token (reaproveitado pelo MSAL enquanto for válido)
+        if debug:
+            st.write("🔐 Obtendo token de acesso...")
+        result = obter_app_msal().acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
 
         if "access_token" in result:
             headers = {"Authorization": f"Bearer {result['access_token']}"}
-            st.success("✅ Token obtido com sucesso!")
+            if debug:
+                st.success("✅ Token obtido com sucesso!")
 
-            # Obter o site_id
-            site_url = "https://graph.microsoft.com/v1.0/sites/rezendeenergia.sharepoint.com:/sites/Intranet"
-            site_response = requests.get(site_url, headers=headers)
-
-            if site_response.status_code == 200:
-                site_data = site_response.json()
-                site_id = site_data['id']
+            # ID do site fica em cache por mais tempo que o conteúdo
+            site_id = obter_site_id(headers)
+            if debug:
                 st.write(f"✅ Site ID obtido: {site_id}")
 
-                # Buscar o arquivo específico
-                st.write("🔍 Buscando arquivo 'DDS DAS EQUIPES GERAL.xlsx'...")
-                search_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root/search(q='DDS DAS EQUIPES GERAL.xlsx')"
-                search_response = requests.get(search_url, headers=headers)
-
-                if search_response.status_code == 200:
-                    search_data = search_response.json()
-                    files_found = search_data.get('value', [])
-                    st.write(f"📋 Encontrados {len(files_found)} arquivo(s)")
-
-                    for item in files_found:
-                        st.write(f"📄 Arquivo: {item['name']}")
-                        if 'parentReference' in item and 'path' in item['parentReference']:
-                            st.write(f"📁 Localização: {item['parentReference']['path']}")
-
-                        # Se for exatamente o arquivo que queremos
-                        if item['name'] == 'DDS DAS EQUIPES GERAL.xlsx':
-                            st.success(f"🎯 Arquivo alvo encontrado! ID: {item['id']}")
-
-                            # Baixar o arquivo usando o ID
-                            download_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item['id']}/content"
-                            st.write("⬇️ Iniciando download...")
-                            download_response = requests.get(download_url, headers=headers)
-
-                            if download_response.status_code == 200:
-                                st.success("✅ Download concluído com sucesso!")
-
-                                # Ler o arquivo Excel
-                                df = pd.read_excel(io.BytesIO(download_response.content))
-                                st.success(f"📊 Arquivo carregado! Dimensões: {df.shape}")
-                                st.write(f"📋 Colunas: {list(df.columns)}")
-
-                                return df
-                            else:
-                                st.error(f"❌ Erro no download: {download_response.status_code}")
-                                st.error(f"Resposta: {download_response.text}")
-
-                    # Se não encontrou o arquivo exato
-                    if not any(item['name'] == 'DDS DAS EQUIPES GERAL.xlsx' for item in files_found):
-                        st.warning("⚠️ Arquivo 'DDS DAS EQUIPES GERAL.xlsx' não encontrado exatamente")
-                        st.write("Arquivos similares encontrados:")
-                        for item in files_found:
-                            if 'DDS' in item['name']:
-                                st.write(f"  📄 {item['name']}")
-                else:
-                    st.error(f"❌ Erro na busca: {search_response.status_code}")
-                    st.error(f"Resposta: {search_response.text}")
-            else:
-                st.error(f"❌ Erro ao obter site: {site_response.status_code}")
-                st.error(f"Resposta: {site_response.text}")
+            # Arquivo pelo caminho: ID e versão atual (o download só acontece se o eTag mudou)
+            item = obter_item(headers, site_id)
+            if debug:
+                st.success(f"🎯 Arquivo alvo encontrado! ID: {item['id']}")
+                st.write("⬇️ Iniciando download...")
+            conteudo = baixar_item_bytes(headers, site_id, item['id'], item['eTag'])
+            if debug:
+                st.success("✅ Download concluído com sucesso!")
+
+            # Ler o arquivo Excel (só para o debug; a leitura fica em cache pelos bytes)
+            if debug:
+                df = ler_planilha_excel(conteudo)
+                st.success(f"📊 Arquivo carregado! Dimensões: {df.shape}")
+                st.write(f"📋 Colunas: {list(df.columns)}")
+
+            # Bytes para as leituras em cache e eTag como versão da base carregada
+            return conteudo, item['eTag']
         else:
             st.error("❌ Erro na autenticação:")
             st.error(result)
@@ -242,122 +323,226 @@ def baixar_planilha_sharepoint_direto():
 
 
 @st.cache_data(ttl=300)  # Cache por 5 minutos
-def baixar_planilha_sharepoint():
-    """Baixa a planilha do SharePoint e retorna DataFrame - método que funcionou"""
+def baixar_planilha_sharepoint(debug: bool = False):
+    """Baixa a planilha do SharePoint e retorna (bytes, eTag) - método que funcionou"""
     with st.spinner("🔄 Conectando ao SharePoint..."):
-        df_raw = baixar_planilha_sharepoint_direto()
+        planilha = baixar_planilha_sharepoint_direto(debug)
 
-    if df_raw is not None:
-        return df_raw
+    if planilha is not None:
+        return planilha
     else:
         st.error("❌ Não foi possível baixar a planilha do SharePoint")
         return None
 
 
+def limpar_cache_planilha():
+    """Força nova verificação da planilha; ID do site e bytes (indexados pelo eTag) são preservados"""
+    baixar_planilha_sharepoint_direto.clear()
+    baixar_planilha_sharepoint.clear()
+
+
 # ———————————————————————————
 # 3. Visualizações (mantidas do código original)
 
+@st.cache_data(show_spinner=False)
 def gerar_dot_moderno(df: pd.DataFrame, config: dict) -> str:
-    """Geração DOT melhorada com configurações personalizáveis"""
-    colors = get_color_palette()
+    """Geração DOT melhorada com configurações personalizáveis (cache por dados + config)"""
+    colors = PALETA_CORES
+
+    # Cada nome único é escapado uma única vez (nomes se repetem em nós e arestas)
+    escapados = {}
 
     def escape_dot(texto: str) -> str:
-        return texto.replace('"', '\\"').replace('\n', '\\n').replace('&', '&amp;')
+        try:
+            return escapados[texto]
+        except KeyError:
+            valor = escapados[texto] = str(texto).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('&', '&amp;')
+            return valor
+
+    # Fragmentos acumulados em lista e unidos uma única vez no final
+    parts = [
+        'digraph Organograma {\n',
+        f'  rankdir={config.get("layout", "LR")};\n',
+        '  compound=true;\n',
+        '  bgcolor="white";\n',
+        '  node [fontname="Helvetica", style=filled, fontsize=10];\n',
+        '  edge [color="#666666", arrowsize=0.8];\n\n',
+    ]
+
+    # Cores resolvidas uma vez, fora dos laços
+    cor_encarregado = config.get("cor_encarregado", colors["encarregado"])
+    cor_funcionario = config.get("cor_funcionario", colors["funcionario"])
+
+    # Uma única partição por supervisor/encarregado (ordem de aparição preservada)
+    grupos_supervisor = df.groupby("supervisor", sort=False, observed=True, dropna=False)
+
+    for idx, (sup, df_sup) in enumerate(grupos_supervisor):
+        cor_supervisor = colors['supervisor'][idx % len(colors['supervisor'])]
+        sup = escape_dot(sup)
+
+        parts.extend((
+            f'  subgraph cluster_{idx} {{\n',
+            f'    label="{sup}";\n',
+            '    style=filled;\n',
+            f'    fillcolor="{cor_supervisor}30";\n',
+            f'    color="{cor_supervisor}";\n',
+            '    penwidth=2;\n',
+            f'    "{sup}" [shape=ellipse, fillcolor="{cor_supervisor}", fontcolor="white", fontsize=12, penwidth=2];\n',
+        ))
+
+        for enc, df_enc in df_sup.groupby("encarregado", sort=False, observed=True, dropna=False):
+            enc = escape_dot(enc)
+            parts.extend((
+                f'    "{enc}" [shape=box, fillcolor="{cor_encarregado}", style="filled,rounded", penwidth=1.5];\n',
+                f'    "{sup}" -> "{enc}" [style=bold, color="{cor_supervisor}"];\n',
+            ))
+
+            for nome, func in zip(df_enc["nome"].to_numpy(), df_enc["funcao"].to_numpy()):
+                nome = escape_dot(nome)
+                func = escape_dot(func)
+                label = f"{nome}\\n({func})"
 
-    dot = f'digraph Organograma {{\n'
-    dot += f'  rankdir={config.get("layout", "LR")};\n'
-    dot += '  compound=true;\n'
-    dot += '  bgcolor="white";\n'
-    dot += '  node [fontname="Helvetica", style=filled, fontsize=10];\n'
-    dot += '  edge [color="#666666", arrowsize=0.8];\n\n'
+                parts.extend((
+                    f'    "{nome}" [shape=box, fillcolor="{cor_funcionario}", label="{label}", style="filled,rounded"];\n',
+                    f'    "{enc}" -> "{nome}" [color="#666666"];\n',
+                ))
 
-    supervisors = df["supervisor"].unique().tolist()
+        parts.append('  }\n\n')
 
-    for idx, sup in enumerate(supervisors):
-        cor_supervisor = colors['supervisor'][idx % len(colors['supervisor'])]
+    parts.append('}\n')
+    return "".join(parts)
 
-        dot += f'  subgraph cluster_{idx} {{\n'
-        dot += f'    label="{escape_dot(sup)}";\n'
-        dot += '    style=filled;\n'
-        dot += f'    fillcolor="{cor_supervisor}30";\n'
-        dot += f'    color="{cor_supervisor}";\n'
-        dot += '    penwidth=2;\n'
-        dot += f'    "{escape_dot(sup)}" [shape=ellipse, fillcolor="{cor_supervisor}", fontcolor="white", fontsize=12, penwidth=2];\n'
 
-        df_sup = df[df["supervisor"] == sup]
-        encarregados = df_sup["encarregado"].unique().tolist()
+@st.cache_resource(show_spinner=False, max_entries=32)
+def renderizar_svg(dot: str) -> Optional[str]:
+    """Layout do Graphviz no servidor, uma vez por DOT (None se o Graphviz faltar ou rejeitar o DOT)"""
+    try:
+        import graphviz
+    except ImportError:
+        return None
 
-        for enc in encarregados:
-            dot += f'    "{escape_dot(enc)}" [shape=box, fillcolor="{config.get("cor_encarregado", colors["encarregado"])}", style="filled,rounded", penwidth=1.5];\n'
-            dot += f'    "{escape_dot(sup)}" -> "{escape_dot(enc)}" [style=bold, color="{cor_supervisor}"];\n'
+    try:
+        return graphviz.Source(dot, engine="dot").pipe(format="svg").decode("utf-8")
+    except (graphviz.ExecutableNotFound, graphviz.CalledProcessError):
+        # Sem o binário "dot" ou DOT inválido: o chamador recai no st.graphviz_chart
+        return None
 
-            for _, row in df_sup[df_sup["encarregado"] == enc].iterrows():
-                nome = escape_dot(row["nome"])
-                func = escape_dot(row["funcao"])
-                label = f"{nome}\\n({func})"
 
-                dot += f'    "{nome}" [shape=box, fillcolor="{config.get("cor_funcionario", colors["funcionario"])}", label="{label}", style="filled,rounded"];\n'
-                dot += f'    "{escape_dot(enc)}" -> "{nome}" [color="#666666"];\n'
+@st.cache_data(show_spinner=False)
+def contar_dds_por_dia(_df: pd.DataFrame, versao: str) -> pd.DataFrame:
+    """Quantidade de DDS (encarregados únicos) por dia (cache pela versão da planilha, sem hash da base)"""
+    dds_por_dia = _df.groupby("data")["encarregado"].nunique().reset_index()
+    dds_por_dia.columns = ["Data", "Quantidade de DDS"]
+    return dds_por_dia
 
-        dot += '  }\n\n'
 
-    dot += '}\n'
-    return dot
+@st.cache_data(show_spinner=False)
+def contar_funcoes_por_dia(_df: pd.DataFrame, versao: str) -> pd.Series:
+    """Contagem de registros por (data, função), somável para qualquer período (cache pela versão da planilha)"""
+    return _df.groupby(["data", "funcao"], observed=True).size()
+
+
+def contar_funcoes(funcoes_por_dia: pd.Series, inicio: pd.Timestamp, fim: pd.Timestamp) -> pd.Series:
+    """Contagem por função no período, com a cauda longa agrupada em "Outros" (máx. 15 fatias)"""
+    datas = funcoes_por_dia.index.get_level_values("data")
+    funcoes_count = (
+        funcoes_por_dia[(datas >= inicio) & (datas <= fim)]
+        .groupby(level="funcao", observed=True).sum()
+        .sort_values(ascending=False)
+    )
+    funcoes_count = funcoes_count[funcoes_count > 0]  # categorias sem ocorrência no período
+    if len(funcoes_count) > 15:
+        funcoes_count = pd.concat([
+            funcoes_count.iloc[:15],
+            pd.Series({"Outros": funcoes_count.iloc[15:].sum()})
+        ])
+    return funcoes_count
+
+
+@st.cache_data(show_spinner=False)
+def contar_encarregados_por_supervisor(df: pd.DataFrame) -> pd.DataFrame:
+    """Encarregados únicos por supervisor, ordenados para o gráfico de barras"""
+    sup_encarregados = df.groupby("supervisor", observed=True)["encarregado"].nunique().reset_index()
+    sup_encarregados.columns = ["Supervisor", "Quantidade de Encarregados"]
+    return sup_encarregados.sort_values("Quantidade de Encarregados", ascending=True)
+
+
+@st.cache_data(show_spinner=False)
+def resumir_equipe(df: pd.DataFrame) -> dict:
+    """Valores únicos e contagens da equipe, calculados uma única vez por DataFrame"""
+    return {
+        "total": len(df),
+        "supervisores": df["supervisor"].unique().tolist(),
+        "funcoes": df["funcao"].unique().tolist(),
+        "n_supervisores": df["supervisor"].nunique(),
+        "n_encarregados": df["encarregado"].nunique(),
+        "n_funcoes": df["funcao"].nunique(),
+    }
 
 
 def criar_estatisticas(df: pd.DataFrame):
     """Dashboard de estatísticas"""
+    resumo = resumir_equipe(df[["supervisor", "encarregado", "funcao"]])
     col1, col2, col3, col4 = st.columns(4)
 
     with col1:
         st.metric(
             label="👥 Total de Pessoas",
-            value=len(df),
+            value=resumo["total"],
             help="Número total de funcionários"
         )
 
     with col2:
         st.metric(
             label="👔 Supervisores",
-            value=df["supervisor"].nunique(),
+            value=resumo["n_supervisores"],
             help="Número de supervisores únicos"
         )
 
     with col3:
         st.metric(
             label="📋 Encarregados",
-            value=df["encarregado"].nunique(),
+            value=resumo["n_encarregados"],
             help="Número de encarregados únicos"
         )
 
     with col4:
         st.metric(
             label="🎯 Funções",
-            value=df["funcao"].nunique(),
+            value=resumo["n_funcoes"],
             help="Diversidade de funções"
         )
 
 
-def comparar_equipes(df_tot: pd.DataFrame, data1: str, data2: str):
+@st.cache_data(show_spinner=False)
+def nomes_por_data(_df: pd.DataFrame, versao: str) -> dict:
+    """Conjunto de nomes presentes em cada data, calculado uma vez por versão da planilha"""
+    return {data: frozenset(grupo["nome"].dropna()) for data, grupo in _df.groupby("data", sort=False)}
+
+
+def comparar_equipes(df_tot: pd.DataFrame, data1: pd.Timestamp, data2: pd.Timestamp, versao: str):
     """Comparação entre duas datas"""
     df1 = df_tot[df_tot["data"] == data1]
     df2 = df_tot[df_tot["data"] == data2]
 
-    st.subheader(f"📊 Comparação: {data1} vs {data2}")
+    st.subheader(f"📊 Comparação: {formatar_data(data1)} vs {formatar_data(data2)}")
 
     col1, col2 = st.columns(2)
 
     with col1:
-        st.write(f"**{data1}**")
+        st.write(f"**{formatar_data(data1)}**")
         criar_estatisticas(df1)
 
     with col2:
-        st.write(f"**{data2}**")
+        st.write(f"**{formatar_data(data2)}**")
         criar_estatisticas(df2)
 
-    # Análise de mudanças
-    pessoas_saida = set(df1["nome"]) - set(df2["nome"])
-    pessoas_entrada = set(df2["nome"]) - set(df1["nome"])
+    # Análise de mudanças (conjuntos de nomes por data em cache)
+    nomes = nomes_por_data(df_tot[["data", "nome"]], versao)
+    nomes1 = nomes.get(data1, frozenset())
+    nomes2 = nomes.get(data2, frozenset())
+    pessoas_saida = sorted(map(str, nomes1 - nomes2))
+    pessoas_entrada = sorted(map(str, nomes2 - nomes1))
 
     if pessoas_saida:
         st.warning(f"🔴 Saídas: {', '.join(pessoas_saida)}")
@@ -380,9 +565,12 @@ with st.sidebar:
 
     # Status da conexão SharePoint
     if st.button("🔄 Atualizar Cache", help="Limpar cache e buscar dados atualizados"):
-        st.cache_data.clear()
+        limpar_cache_planilha()
         st.rerun()
 
+    debug_sharepoint = st.toggle("🐞 Debug SharePoint", value=False,
+                                 help="Exibir cada etapa da conexão com o SharePoint")
+
     if modo == "📊 Visualizar Organograma":
         st.subheader("🎨 Personalização")
 
@@ -400,9 +588,13 @@ if modo == "📊 Visualizar Organograma":
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         if st.button("📥 Carregar Dados do SharePoint", type="primary", use_container_width=True):
-            df_raw = baixar_planilha_sharepoint()
+            planilha = baixar_planilha_sharepoint(debug_sharepoint)
+
+            if planilha is not None:
+                conteudo, versao = planilha
+                df_raw = ler_planilha_excel(conteudo)
+                st.toast(f"📊 Planilha carregada ({len(df_raw)} linhas)")
 
-            if df_raw is not None:
                 # Mapear colunas
                 mapeamento = mapear_colunas(df_raw.columns.tolist())
                 obrigatórias = ["data", "nome", "funcao", "encarregado", "supervisor"]
@@ -412,23 +604,33 @@ if modo == "📊 Visualizar Organograma":
                     st.error(f"❌ Colunas não encontradas: {', '.join(faltando)}")
                     st.write("**🔍 Colunas encontradas:**", list(df_raw.columns))
                 else:
-                    # Renomear e limpar dados
-                    df = df_raw.rename(columns={v: k for k, v in mapeamento.items()})
-                    df = limpar_dados(df)
-
-                    # Validar dados
-                    valido, erros = validar_dados(df)
+                    # Renomear, limpar e validar (em cache pelos bytes: qualquer edição gera nova entrada)
+                    df, valido, erros = processar_planilha(conteudo)
 
-                    if erros:
-                        st.warning("⚠️ Avisos encontrados:")
-                        for erro in erros:
-                            st.write(f"- {erro}")
-
-                    if valido or st.checkbox("🚀 Prosseguir mesmo com avisos"):
+                    if valido:
                         st.success("✅ Dados do SharePoint carregados com sucesso!")
                         st.session_state["df_equipes"] = df
+                        st.session_state["versao_dados"] = versao
                         st.session_state["fonte_dados"] = "SharePoint"
+                        st.session_state.pop("carga_pendente", None)
                         st.rerun()
+                    else:
+                        # Guardada fora do ramo do botão: marcar o checkbox dispara um rerun sem o clique
+                        st.session_state["carga_pendente"] = (df, erros, versao)
+
+        # Carga com avisos aguardando confirmação do usuário
+        if "carga_pendente" in st.session_state:
+            df_pendente, erros, versao_pendente = st.session_state["carga_pendente"]
+            st.warning("⚠️ Avisos encontrados:")
+            for erro in erros:
+                st.write(f"- {erro}")
+
+            if st.checkbox("🚀 Prosseguir mesmo com avisos"):
+                st.session_state["df_equipes"] = df_pendente
+                st.session_state["versao_dados"] = versao_pendente
+                st.session_state["fonte_dados"] = "SharePoint"
+                del st.session_state["carga_pendente"]
+                st.rerun()
 
     if "df_equipes" not in st.session_state:
         st.info("ℹ️ Clique no botão acima para carregar os dados do SharePoint")
@@ -444,8 +646,8 @@ if modo == "📊 Visualizar Organograma":
     # Seleção de data
     col1, col2 = st.columns([2, 1])
     with col1:
-        datas = sorted(df_total["data"].unique(), reverse=True)
-        data_selecionada = st.selectbox("📅 Selecione a data:", datas)
+        datas = df_total["data"].dropna().drop_duplicates().sort_values(ascending=False).tolist()
+        data_selecionada = st.selectbox("📅 Selecione a data:", datas, format_func=formatar_data)
 
     with col2:
         st.write("")  # Espaçamento
@@ -457,7 +659,7 @@ if modo == "📊 Visualizar Organograma":
         st.warning("⚠️ Nenhum registro para essa data.")
     else:
         # Visualização com Graphviz melhorado
-        st.markdown(f"### 🏢 Organograma - {data_selecionada}")
+        st.markdown(f"### 🏢 Organograma - {formatar_data(data_selecionada)}")
 
         if mostrar_stats:
             criar_estatisticas(df_selecionado)
@@ -465,18 +667,20 @@ if modo == "📊 Visualizar Organograma":
 
         # Filtros avançados
         with st.expander("🔍 Filtros Avançados"):
+            # Mesmo resumo (em cache) usado pelas estatísticas acima
+            resumo = resumir_equipe(df_selecionado[["supervisor", "encarregado", "funcao"]])
             col1, col2 = st.columns(2)
             with col1:
                 supervisores_selecionados = st.multiselect(
                     "Filtrar por supervisor:",
-                    df_selecionado["supervisor"].unique(),
-                    default=df_selecionado["supervisor"].unique()
+                    resumo["supervisores"],
+                    default=resumo["supervisores"]
                 )
             with col2:
                 funcoes_selecionadas = st.multiselect(
                     "Filtrar por função:",
-                    df_selecionado["funcao"].unique(),
-                    default=df_selecionado["funcao"].unique()
+                    resumo["funcoes"],
+                    default=resumo["funcoes"]
                 )
 
             # Aplicar filtros
@@ -491,39 +695,51 @@ if modo == "📊 Visualizar Organograma":
             "cor_encarregado": cor_encarregado,
             "cor_funcionario": cor_funcionario
         }
-        dot = gerar_dot_moderno(df_selecionado, config)
-        st.graphviz_chart(dot, use_container_width=True)
+        # Só as colunas do organograma entram na chave do cache
+        colunas_dot = ["supervisor", "encarregado", "nome", "funcao"]
+        dot = gerar_dot_moderno(df_selecionado[colunas_dot], config)
+        svg = renderizar_svg(dot)
+        if svg is not None:
+            st.image(svg, use_container_width=True)
+        else:
+            st.graphviz_chart(dot, use_container_width=True)
 
         # Exportação
         col1, col2, col3 = st.columns(3)
         with col1:
             buffer = io.BytesIO()
-            df_selecionado.to_excel(buffer, index=False, sheet_name="Equipe")
+            # Data volta ao formato dd/mm/aaaa só na exportação
+            with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+                df_selecionado.assign(data=df_selecionado["data"].dt.strftime("%d/%m/%Y")).to_excel(
+                    writer, index=False, sheet_name="Equipe"
+                )
             buffer.seek(0)
             st.download_button(
                 "📥 Exportar Excel",
                 data=buffer,
-                file_name=f"equipe_{data_selecionada.replace('/', '-')}.xlsx",
+                file_name=f"equipe_{data_selecionada.strftime('%d-%m-%Y')}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
 
         with col2:
             # Exportar DOT
             config = {"layout": layout_direction}
-            dot_export = gerar_dot_moderno(df_selecionado, config)
+            dot_export = gerar_dot_moderno(df_selecionado[colunas_dot], config)
             st.download_button(
                 "📄 Exportar .dot",
                 data=dot_export,
-                file_name=f"organograma_{data_selecionada.replace('/', '-')}.dot",
+                file_name=f"organograma_{data_selecionada.strftime('%d-%m-%Y')}.dot",
                 mime="text/plain"
             )
 
         with col3:
             if st.button("🔄 Recarregar"):
-                st.cache_data.clear()
+                limpar_cache_planilha()
                 st.rerun()
 
 elif modo == "📈 Análises":
+    import plotly.express as px  # import tardio: plotly só é necessário nesta página
+
     if "df_equipes" not in st.session_state:
         st.warning("⚠️ Carregue os dados primeiro na página 'Visualizar Organograma'.")
     else:
@@ -533,25 +749,25 @@ elif modo == "📈 Análises":
         # Filtro de data "entre datas"
         col1, col2, col3 = st.columns([2, 2, 1])
 
-        # Converter datas para datetime para os date_input
-        datas_disponiveis = sorted(df_total["data"].unique())
-        datas_dt = [pd.to_datetime(data, format="%d/%m/%Y").date() for data in datas_disponiveis]
+        # Limites do período para os date_input (coluna já está em datetime64)
+        primeira_data = df_total["data"].min().date()
+        ultima_data = df_total["data"].max().date()
 
         with col1:
             data_inicial = st.date_input(
                 "📅 Data Inicial:",
-                value=min(datas_dt),
-                min_value=min(datas_dt),
-                max_value=max(datas_dt),
+                value=primeira_data,
+                min_value=primeira_data,
+                max_value=ultima_data,
                 format="DD/MM/YYYY"
             )
 
         with col2:
             data_final = st.date_input(
                 "📅 Data Final:",
-                value=max(datas_dt),
-                min_value=min(datas_dt),
-                max_value=max(datas_dt),
+                value=ultima_data,
+                min_value=primeira_data,
+                max_value=ultima_data,
                 format="DD/MM/YYYY"
             )
 
@@ -561,15 +777,12 @@ elif modo == "📈 Análises":
                 st.rerun()
 
         # Aplicar filtro de período
-        # Converter as datas selecionadas de volta para string no formato original
         data_inicial_str = data_inicial.strftime("%d/%m/%Y")
         data_final_str = data_final.strftime("%d/%m/%Y")
 
-        # Filtrar dados no período selecionado
-        df_filtrado = df_total[
-            (pd.to_datetime(df_total["data"], format="%d/%m/%Y").dt.date >= data_inicial) &
-            (pd.to_datetime(df_total["data"], format="%d/%m/%Y").dt.date <= data_final)
-            ]
+        # Filtrar dados no período selecionado (comparação direta em datetime64)
+        inicio, fim = pd.Timestamp(data_inicial), pd.Timestamp(data_final)
+        df_filtrado = df_total[df_total["data"].between(inicio, fim)]
 
         if df_filtrado.empty:
             st.warning("⚠️ Nenhum dado encontrado para o período selecionado.")
@@ -580,21 +793,35 @@ elif modo == "📈 Análises":
 
         # Gráfico: DDS por dia
         st.subheader("📊 Quantidade de DDS por Dia")
-        dds_por_dia = df_filtrado.groupby("data")["encarregado"].nunique().reset_index()
-        dds_por_dia.columns = ["Data", "Quantidade de DDS"]
+        # Resumos diários calculados uma vez sobre a base inteira e apenas recortados pelo período
+        dds_todos_dias = contar_dds_por_dia(df_total[["data", "encarregado"]], st.session_state["versao_dados"])
+        dds_por_dia = dds_todos_dias[dds_todos_dias["Data"].between(inicio, fim)]
+
+        # Muitos pontos (> 1000 dias com DDS): plotar a média semanal para manter o gráfico leve
+        # (semanas sem registro descartadas para não criar barras vazias)
+        if len(dds_por_dia) > 1000:
+            dds_grafico = dds_por_dia.resample("W", on="Data")["Quantidade de DDS"].mean().round(1).dropna().reset_index()
+            titulo_dds = "📋 Média Semanal de DDS (Encarregados) por Dia"
+            rotulos_dds = {"Data": "Semana", "Quantidade de DDS": "Média de DDS por Dia"}
+        else:
+            dds_grafico = dds_por_dia
+            titulo_dds = "📋 Número de DDS (Encarregados) por Dia"
+            rotulos_dds = {}
+        dds_grafico = dds_grafico.assign(Data=dds_grafico["Data"].dt.strftime("%d/%m/%Y"))
 
         fig_dds = px.bar(
-            dds_por_dia,
+            dds_grafico,
             x="Data",
             y="Quantidade de DDS",
-            title="📋 Número de DDS (Encarregados) por Dia",
+            title=titulo_dds,
+            labels=rotulos_dds,
             color="Quantidade de DDS",
             color_continuous_scale="Blues",
             text="Quantidade de DDS"  # Adicionar rótulos
         )
         fig_dds.update_traces(texttemplate='%{text}', textposition='outside')
         # Ajustar escala do eixo Y para dar espaço aos rótulos
-        max_value = dds_por_dia["Quantidade de DDS"].max()
+        max_value = dds_grafico["Quantidade de DDS"].max()
         fig_dds.update_layout(
             height=400,
             yaxis=dict(range=[0, max_value * 1.15])  # Adiciona 15% de espaço extra
@@ -606,7 +833,7 @@ elif modo == "📈 Análises":
 
         with col1:
             # Distribuição por função
-            funcoes_count = df_filtrado["funcao"].value_counts()
+            funcoes_count = contar_funcoes(contar_funcoes_por_dia(df_total[["data", "funcao"]], st.session_state["versao_dados"]), inicio, fim)
             fig_funcoes = px.pie(
                 values=funcoes_count.values,
                 names=funcoes_count.index,
@@ -621,9 +848,7 @@ elif modo == "📈 Análises":
 
         with col2:
             # Encarregados por Supervisor
-            sup_encarregados = df_filtrado.groupby("supervisor")["encarregado"].nunique().reset_index()
-            sup_encarregados.columns = ["Supervisor", "Quantidade de Encarregados"]
-            sup_encarregados = sup_encarregados.sort_values("Quantidade de Encarregados", ascending=True)
+            sup_encarregados = contar_encarregados_por_supervisor(df_filtrado[["supervisor", "encarregado"]])
 
             fig_sup = px.bar(
                 sup_encarregados,
@@ -664,7 +889,7 @@ elif modo == "📈 Análises":
                 st.metric(
                     "🏆 Máximo DDS/dia",
                     max_dds,
-                    help=f"Maior número registrado em {data_max}"
+                    help=f"Maior número registrado em {formatar_data(data_max)}"
                 )
             else:
                 st.metric("🏆 Máximo DDS/dia", "0")
@@ -683,7 +908,7 @@ elif modo == "🔄 Comparar Datas":
         st.warning("⚠️ Carregue os dados primeiro na página 'Visualizar Organograma'.")
     else:
         df_total = st.session_state["df_equipes"]
-        datas = sorted(df_total["data"].unique())
+        datas = df_total["data"].dropna().drop_duplicates().sort_values().tolist()
 
         if len(datas) < 2:
             st.warning("⚠️ É necessário ter pelo menos 2 datas para comparação.")
@@ -692,12 +917,12 @@ elif modo == "🔄 Comparar Datas":
 
             col1, col2 = st.columns(2)
             with col1:
-                data1 = st.selectbox("📅 Data 1:", datas, key="data1")
+                data1 = st.selectbox("📅 Data 1:", datas, format_func=formatar_data, key="data1")
             with col2:
-                data2 = st.selectbox("📅 Data 2:", datas, index=1, key="data2")
+                data2 = st.selectbox("📅 Data 2:", datas, index=1, format_func=formatar_data, key="data2")
 
             if data1 != data2:
-                comparar_equipes(df_total, data1, data2)
+                comparar_equipes(df_total, data1, data2, st.session_state["versao_dados"])
             else:
                 st.info("🔄 Selecione datas diferentes para comparação.")
 